@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+# Author: Milan Nikolic <gen2brain@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gobject
+
+class ChangeBus:
+    """ Merges published changes, subscribers get one delta per main loop iteration """
+    def __init__(self):
+        self.subscribers = []
+        self.values = {}
+        self.delta = {}
+        self.source = None
+
+    def subscribe(self, fields, hook):
+        """ hook gets dict with changed values of given fields """
+        self.subscribers.append( (fields, hook) )
+
+    def unsubscribe(self, hook):
+        self.subscribers = [(fields, h) for fields, h in self.subscribers if h != hook]
+
+    def get(self, field, default = None):
+        """ Returns last published value """
+        return self.values.get(field, default)
+
+    def publish(self, **changes):
+        self.values.update(changes)
+        self.delta.update(changes)
+        if ( not self.source ):
+            self.source = gobject.idle_add(self.dispatch)
+
+    def dispatch(self):
+        self.source = None
+        delta = self.delta
+        self.delta = {}
+        for fields, hook in list(self.subscribers):
+            changes = dict([(field, delta[field]) for field in fields if field in delta])
+            if (changes):
+                hook(changes)
+        return False
@@ -16,12 +16,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import atexit
+import tempfile
+import gobject
+import gio
+from StringIO import StringIO
+from threading import Thread, Lock
+from collections import namedtuple
 from ConfigParser import RawConfigParser, DEFAULTSECT
 from mixerbase import CardInfo
 from debug import log
 
 class ConfigAbstract(RawConfigParser):
     _defaults = {}
+    #types of default section options, which are exposed in snapshot
+    _types = {}
+    #bursts of set() calls are written once, after this delay in ms
+    save_delay = 1000
     app_name = ""
     app_version = ""
     def __init__(self, filename = "config"):
@@ -30,8 +41,19 @@ class ConfigAbstract(RawConfigParser):
         self.res_dir = None
         self.locale_dir = None
         self.updated = False
+        self.snapshot_type = namedtuple("ConfigSnapshot", sorted(self._types.keys()))
+        self.snapshot = None
+        self.subscribers = []
+        self.notify_source = None
+        self.save_source = None
+        self.save_lock = Lock()
+        self.save_seq = 0
+        self.saved_seq = 0
+        #text of config file, as it was last written or reloaded by us
+        self.file_data = None
         self.set_filename(filename)
         self.load()
+        atexit.register(self.flush)
 
     def set_filename(self, filename):
         if not os.path.isdir(os.path.join(".","src")):
@@ -59,44 +81,225 @@ class ConfigAbstract(RawConfigParser):
     
     def set(self, section, option, value):
         self.updated = True
-        log.Notice("set value %s for option %s" %(value, option), 1)
+        log.Notice("set value %s for option %s", value, option, depth = 1)
         RawConfigParser.set(self, section, option, value)
+        self.changed()
+        self.schedule_save()
+        
+    def changed(self):
+        """ Drops snapshot, subscribers get new one once per main loop iteration """
+        self.snapshot = None
+        if ( self.subscribers and not self.notify_source ):
+            self.notify_source = gobject.idle_add(self.on_changed)
+            
+    def on_changed(self):
+        self.notify_source = None
+        snapshot = self.get_snapshot()
+        for hook in list(self.subscribers):
+            hook(snapshot)
+        return False
+        
+    def subscribe(self, hook):
+        """ hook gets new snapshot after config is changed """
+        self.subscribers.append(hook)
+        
+    def unsubscribe(self, hook):
+        if ( hook in self.subscribers ):
+            self.subscribers.remove(hook)
+    
+    def get_snapshot(self):
+        """ Returns immutable typed values of default section, built once per change """
+        if ( self.snapshot is None ):
+            values = {}
+            for option, kind in self._types.items():
+                values[option] = self._get_typed(option, kind)
+            self.snapshot = self.snapshot_type(**values)
+        return self.snapshot
+        
+    def _get_typed(self, option, kind):
+        section = self.get_default_section()
+        getters = {int: self.getint, float: self.getfloat, bool: self.getboolean, str: self.get}
+        try:
+            return getters[kind](section, option)
+        except ValueError, err:
+            log.Warn("Invalid value of %s, default is used: %s", option, str(err))
+            #instance _defaults holds live values, class table holds shipped defaults
+            default = self.__class__._defaults[option]
+            if ( kind == bool ):
+                return str(default).lower() == "true"
+            return kind(default)
+    
+    def schedule_save(self):
+        """ Restarts save timer, so only last change of a burst is written """
+        if (self.save_source):
+            gobject.source_remove(self.save_source)
+        self.save_source = gobject.timeout_add(self.save_delay, self.on_save_timeout)
+        
+    def on_save_timeout(self):
+        self.save_source = None
+        self.save()
+        return False
     
     def save(self):
-        """ Write config file """
-        if (not self.updated):
-            return
+        """ Write config file in background thread """
+        data = self.dump()
+        if (data):
+            Thread(target = self.write_file, args = data).start()
+            
+    def flush(self):
+        """ Write pending changes now, used on exit """
+        if (self.save_source):
+            gobject.source_remove(self.save_source)
+            self.save_source = None
+        data = self.dump()
+        if (data):
+            self.write_file(*data)
             
-        if not os.path.isdir(self.config_dir):
+    def dump(self):
+        """ Returns numbered config text, or None when nothing is changed """
+        if (not self.updated):
+            return None
+        self.updated = False
+        self.save_seq += 1
+        buf = StringIO()
+        self.write(buf)
+        return (self.save_seq, buf.getvalue())
+    
+    def write_file(self, seq, data):
+        """ Replaces config file atomically, so crash can't leave it truncated """
+        self.save_lock.acquire()
+        try:
+            #newer text is already written by other thread
+            if (seq <= self.saved_seq):
+                return
+            if not os.path.isdir(self.config_dir):
+                try:
+                    os.makedirs(self.config_dir)
+                except OSError:
+                    pass
+            log.Notice("Saving config to %s", self.config_file)
+            #mkstemp creates file with 0600, mode of replaced file is kept
             try:
-                os.makedirs(self.config_dir)
+                mode = os.stat(self.config_file).st_mode & 0777
             except OSError:
-                pass
-        log.Notice("Saving config to %s" % self.config_file)
-        configfile = open(self.config_file, 'w')
-        self.write(configfile)
-        self.updated = False
+                mode = 0644
+            (fd, tmpname) = tempfile.mkstemp(prefix = ".config-", dir = self.config_dir)
+            configfile = os.fdopen(fd, "w")
+            try:
+                os.fchmod(fd, mode)
+                configfile.write(data)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+                configfile.close()
+                os.rename(tmpname, self.config_file)
+            except:
+                configfile.close()
+                os.remove(tmpname)
+                raise
+            self.saved_seq = seq
+            self.file_data = data
+        except (OSError, IOError), err:
+            log.Warn("Can\'t save config to %s: %s", self.config_file, str(err))
+            #change is written again by next save or flush on exit
+            self.updated = True
+        finally:
+            self.save_lock.release()
 
     def load(self):
-        return self.readfile()
+        readed = self.readfile()
+        self.changed()
+        return readed
+    
+    def reload(self):
+        """ Applies external edits of config file, returns set of changed (section, option) """
+        try:
+            configfile = open(self.config_file)
+            data = configfile.read()
+            configfile.close()
+        except IOError, err:
+            log.Warn("Can\'t reload config: %s", str(err))
+            return set()
+        #own write or same text
+        if ( data == self.file_data ):
+            return set()
+        self.file_data = data
+        
+        parser = RawConfigParser()
+        try:
+            parser.readfp(StringIO(data), self.config_file)
+        except Exception, err:
+            log.Warn("Can\'t parse config: %s", str(err))
+            return set()
+        
+        changed = set()
+        default = self.get_default_section()
+        for option, value in parser.defaults().items():
+            if ( not self.has_option(default, option) or self.get(default, option) != value ):
+                changed.add( (default, option) )
+        defaults = parser.defaults()
+        for section in parser.sections():
+            for option in parser.options(section):
+                value = parser.get(section, option)
+                #inherited from default section
+                if ( defaults.get(option) == value ):
+                    continue
+                if ( not self.has_section(section) or not self.has_option(section, option) or self.get(section, option) != value ):
+                    changed.add( (section, option) )
+        
+        #applied without set(), so reloaded values are not written back
+        for section, option in changed:
+            if ( section != default and not self.has_section(section) ):
+                self.add_section(section)
+            RawConfigParser.set(self, section, option, parser.get(section, option))
+        if (changed):
+            log.Notice("config reloaded: %s", sorted(changed))
+            self.changed()
+        return changed
     
 class Config(ConfigAbstract):
 
     _defaults = {
     "card_index": 0,
+    "card_id": "",
     "mixer": "alsamixer",
     "run_in_terminal": "true",
     "mixer_internal": "true",
     "mixer_show_values": "true",
     "scale_increment": 5.0,
     "scale_show_value": "true",
+    "slider_write_rate": 25,
     "show_tooltip": "true",
     "toggle": "mute",
     "show_notify": "true",
     "notify_timeout": 3.0,
     "notify_position": "true",
+    "poll_interval": 200,
+    "poll_interval_idle": 4000,
+    "poll_backoff_ticks": 10,
+    "watchdog_threshold": 0,
     "notify_body": '<span font_desc="14" weight="bold">{volume}</span>\n<small>{card}</small>\n<small>{mixer}</small>'
     }
+    _types = {
+    "card_index": int,
+    "card_id": str,
+    "mixer": str,
+    "run_in_terminal": bool,
+    "mixer_internal": bool,
+    "mixer_show_values": bool,
+    "scale_increment": float,
+    "scale_show_value": bool,
+    "slider_write_rate": int,
+    "show_tooltip": bool,
+    "toggle": str,
+    "show_notify": bool,
+    "notify_timeout": float,
+    "notify_position": bool,
+    "poll_interval": int,
+    "poll_interval_idle": int,
+    "poll_backoff_ticks": int,
+    "watchdog_threshold": int,
+    "notify_body": str
+    }
     app_name = "voltilite"
     app_version = "0.1-svn"
 
@@ -111,9 +314,55 @@ class Config(ConfigAbstract):
         return "card-%s" % card_index
     
     def set_card_index(self, card_index):
-        log.Notice("set card_index = %s" % card_index)
+        log.Notice("set card_index = %s", card_index)
         self.set(self.get_default_section(), "card_index", card_index)
+        self.set(self.get_default_section(), "card_id", CardInfo.get_card_id(card_index) or "")
+        self.check_card_index(card_index)
+    
+    def sync_card_binding(self, options):
+        """ Keeps card_index and card_id pointing to the same card after reload, returns True if card is changed """
+        default = self.get_default_section()
+        if ( "card_index" in options ):
+            card_id = CardInfo.get_card_id(self.getint(default, "card_index")) or ""
+            #reloaded values are not written back
+            RawConfigParser.set(self, default, "card_id", card_id)
+        elif ( "card_id" in options ):
+            card_index = CardInfo.get_card_index(self.get(default, "card_id"))
+            if ( card_index == None or card_index == self.getint(default, "card_index") ):
+                return False
+            RawConfigParser.set(self, default, "card_index", card_index)
+        else:
+            return False
+        self.changed()
+        return True
+    
+    def get_card_binding(self):
+        """ Returns (card_index, control, cid) of tray control """
+        card_index = self.getint(self.get_default_section(), "card_index")
+        section = self.get_card_section_name(card_index)
+        if ( not self.has_option(section, "control") ):
+            return (card_index, None, None)
+        return (card_index, self.get(section, "control"), self.getint(section, "cid"))
+    
+    def rebind_card(self):
+        """ Follows card_id to its current index after hotplug, uses first card while it is absent. Returns True if binding is changed """
+        binding = self.get_card_binding()
+        default = self.get_default_section()
+        card_index = CardInfo.get_card_index(self.get(default, "card_id"))
+        if ( card_index == None ):
+            card_index = CardInfo.get_default_card_index()
+            if ( card_index == None ):
+                return False
+        if ( card_index != self.getint(default, "card_index") ):
+            log.Notice("rebind card_index = %s", card_index)
+            self.set(default, "card_index", card_index)
         self.check_card_index(card_index)
+        
+        section = self.get_card_section()
+        control = [self.get(section, "control"), self.getint(section, "cid")]
+        if ( control not in CardInfo.get_mixers(card_index) ):
+            self.set_card_mixer()
+        return self.get_card_binding() != binding
     
     def check_card_index(self, card_index):
         section = self.get_card_section()
@@ -134,10 +383,53 @@ class Config(ConfigAbstract):
         self.set(c, "cid", cid)
         
     def load(self):
-        readed = ConfigAbstract.readfile(self)
-        if ( not readed or not self.has_section(self.get_card_section()) ):
+        readed = ConfigAbstract.load(self)
+        if ( not readed or not self.has_section(self.get_card_section()) or not self.get(self.get_default_section(), "card_id") ):
             card_index = self.getint(self.get_default_section(), "card_index")
             self.set_card_index(card_index)
         if not readed:
             self.updated = True
             self.save()
+
+class ConfigMonitor:
+    """ Watches config file, calls hook with changed options after it is edited by other program """
+    delay = 500
+    
+    def __init__(self, config, hook):
+        self.config = config
+        self.hook = hook
+        self.source = None
+        self.name = os.path.basename(config.config_file)
+        #directory is watched, because file is replaced by rename
+        try:
+            self.monitor = gio.File(config.config_dir).monitor_directory()
+            self.monitor.connect("changed", self.on_changed)
+        except Exception, err:
+            log.Warn("Can't monitor %s: %s", config.config_dir, str(err))
+            self.monitor = None
+            
+    def close(self):
+        if (self.monitor):
+            self.monitor.cancel()
+            self.monitor = None
+        if (self.source):
+            gobject.source_remove(self.source)
+            self.source = None
+            
+    def on_changed(self, monitor, file, other_file, event_type):
+        names = [file.get_basename()]
+        if (other_file):
+            names.append(other_file.get_basename())
+        if ( self.name not in names ):
+            return
+        #editors write file in several steps, wait until it is settled
+        if (self.source):
+            gobject.source_remove(self.source)
+        self.source = gobject.timeout_add(self.delay, self.on_settled)
+        
+    def on_settled(self):
+        self.source = None
+        changed = self.config.reload()
+        if (changed):
+            self.hook(changed)
+        return False
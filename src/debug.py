@@ -17,26 +17,79 @@
 
 import sys
 import os
-import traceback
+import logging
+import logging.handlers
+
+class StreamSink:
+    """ Writes notices to stdout, warnings and errors to stderr """
+    def write(self, level, text):
+        if ( level >= log.WARN ):
+            sys.stderr.write(text)
+        else:
+            sys.stdout.write(text)
+
+class HandlerSink:
+    """ Passes messages to logging handler, e.g. rotating file or syslog """
+    def __init__(self, handler):
+        self.handler = handler
+        
+    def write(self, level, text):
+        record = logging.makeLogRecord({"msg": text.rstrip("\n"), "levelno": level,
+                                        "levelname": logging.getLevelName(level)})
+        self.handler.handle(record)
 
 class log:
+    NOTICE = logging.INFO
+    WARN = logging.WARNING
+    ERROR = logging.ERROR
+    levels = {"notice": NOTICE, "warn": WARN, "error": ERROR}
+    
+    #messages below this level are dropped before formatting
+    level = WARN
+    sink = StreamSink()
+    
     @staticmethod
-    def _get_trace(msg, depth):
-        exc_traceback = traceback.extract_stack()
-        exc_traceback.reverse()
-        (filename, linenumber, functionname, text) = exc_traceback[2 + depth]
-        filename = os.path.basename(filename)
-        return "[%s:%s:%s] %s\n" % (filename, functionname, linenumber, msg)
+    def configure(level = None, sink = None):
+        if ( level is not None ):
+            log.level = level
+        if ( sink is not None ):
+            log.sink = sink
+    
+    @staticmethod
+    def configure_from_env():
+        """ VOLTILITE_LOG=notice|warn|error, VOLTILITE_LOG_FILE=path or VOLTILITE_LOG_SYSLOG=1 """
+        level = log.levels.get(os.getenv("VOLTILITE_LOG", "").lower())
+        sink = None
+        filename = os.getenv("VOLTILITE_LOG_FILE")
+        if (filename):
+            sink = HandlerSink(logging.handlers.RotatingFileHandler(filename, maxBytes = 1 << 20, backupCount = 3))
+        elif (os.getenv("VOLTILITE_LOG_SYSLOG")):
+            sink = HandlerSink(logging.handlers.SysLogHandler(address = "/dev/log"))
+        log.configure(level, sink)
+    
+    @staticmethod
+    def _write(level, msg, args, depth):
+        """ Caller info is taken from frame, only for enabled messages """
+        frame = sys._getframe(2 + depth)
+        code = frame.f_code
+        if (args):
+            msg = msg % args
+        filename = os.path.basename(code.co_filename)
+        log.sink.write(level, "[%s:%s:%s] %s\n" % (filename, code.co_name, frame.f_lineno, msg))
         
     @staticmethod
-    def Notice(msg, depth = 0):
-        sys.stdout.write(log._get_trace(msg, depth))
+    def Notice(msg, *args, **kwargs):
+        if ( log.NOTICE >= log.level ):
+            log._write(log.NOTICE, msg, args, kwargs.get("depth", 0))
 
     @staticmethod
-    def Warn(msg, depth = 0):
-        sys.stderr.write(log._get_trace(msg, depth))
+    def Warn(msg, *args, **kwargs):
+        if ( log.WARN >= log.level ):
+            log._write(log.WARN, msg, args, kwargs.get("depth", 0))
     
     @staticmethod
-    def Error(msg, depth = 0, exit_code = 1):
-        log.Warn(msg + "\nExiting", depth + 1)
-        sys.exit(exit_code)
+    def Error(msg, *args, **kwargs):
+        log._write(log.ERROR, msg + "\nExiting", args, kwargs.get("depth", 0))
+        sys.exit(kwargs.get("exit_code", 1))
+
+log.configure_from_env()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Author: Milan Nikolic <gen2brain@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import signal
+import gobject
+from bisect import bisect_left
+from threading import Lock
+from debug import log
+
+class Histogram:
+    """ Latency counts in power of two millisecond buckets """
+    bounds = [0.25 * (2 ** i) for i in range(14)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.buckets[bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ( ms > self.max ):
+            self.max = ms
+
+    def percentile(self, part):
+        """ Returns upper bound of bucket, which holds given part of values """
+        rank = part * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if ( seen >= rank and count ):
+                if ( index < len(self.bounds) ):
+                    return self.bounds[index]
+                return self.max
+        return 0.0
+
+    def format(self):
+        return "count=%d avg=%.2fms p50<=%.2fms p99<=%.2fms max=%.2fms" % (
+            self.count, self.total / max(self.count, 1),
+            self.percentile(0.5), self.percentile(0.99), self.max)
+
+class Metrics:
+    """ Counters and latency histograms, used from main loop and mixer thread """
+    lock = Lock()
+    counters = {}
+    histograms = {}
+    started = time.time()
+
+    @staticmethod
+    def count(name, value = 1):
+        Metrics.lock.acquire()
+        Metrics.counters[name] = Metrics.counters.get(name, 0) + value
+        Metrics.lock.release()
+
+    @staticmethod
+    def observe(name, start):
+        """ Adds time passed since start, which is taken from time.time() """
+        ms = (time.time() - start) * 1000
+        Metrics.lock.acquire()
+        histogram = Metrics.histograms.get(name)
+        if ( not histogram ):
+            histogram = Metrics.histograms[name] = Histogram()
+        histogram.add(ms)
+        Metrics.lock.release()
+
+    @staticmethod
+    def dump():
+        Metrics.lock.acquire()
+        lines = ["metrics for last %ds:" % (time.time() - Metrics.started)]
+        for name in sorted(Metrics.counters):
+            lines.append("  %s: %d" % (name, Metrics.counters[name]))
+        for name in sorted(Metrics.histograms):
+            lines.append("  %s: %s" % (name, Metrics.histograms[name].format()))
+        Metrics.lock.release()
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def install():
+        """ kill -USR1 <pid> writes metrics to log """
+        signal.signal(signal.SIGUSR1, Metrics.on_signal)
+
+    @staticmethod
+    def on_signal(signum, frame):
+        #lock can be held by interrupted code, dump is done in main loop
+        gobject.idle_add(Metrics.report)
+
+    @staticmethod
+    def report():
+        log.sink.write(log.WARN, Metrics.dump())
+        return False
@@ -20,7 +20,7 @@ import os
 from config import Config
 from debug import log
 from mixercontrols import MixerControlFrame, ApplicationAbstract
-from mixerbase import MixerAbstract, CardInfo, MixerHandler
+from mixerbase import MixerAbstract, CardInfo, MixerHandler, CardMonitor
 
 class Mixer(MixerAbstract):
     def __init__(self, config, card_index, card_name):
@@ -50,8 +50,17 @@ class Mixer(MixerAbstract):
         MixerAbstract.del_control(self, control)
         
     def init(self):
+        """ Page stays empty until populate, see MixersContainer.on_switch_page """
+        self.populated = False
+        
+    def populate(self):
+        if (self.populated):
+            return
+        log.Notice("populate mixer %s:%s", self.card_index, self.card_name)
+        self.populated = True
         for control_name, cid in CardInfo.get_mixers(self.card_index):
             self.add_control(MixerControlFrame(self.config, self.card_index, control_name, cid))
+        self.frame.show_all()
             
 
 class MixersContainer(gtk.Notebook):
@@ -59,16 +68,19 @@ class MixersContainer(gtk.Notebook):
         gtk.Notebook.__init__(self)
         self.config = config
         self.mixers = []
+        self.shown = False
         self.set_tab_pos(gtk.POS_TOP)
-        self.mixer_handle = MixerHandler.connect(self.on_change)
+        self.monitor = CardMonitor(self.on_cards_changed)
         
     def __del__(self):
-        MixerHandler.disconnect(self.mixer_handle)
+        self.monitor.close()
+        for mixer in self.mixers:
+            mixer.disconnect()
         
         for mixer in self.mixers:
             for control in mixer.controls:
                 if ( control.control == "PCM"):
-                    log.Notice("%s=%s" % (control.control, control.get_lock()))
+                    log.Notice("%s=%s", control.control, control.get_lock())
         
         for mixer in self.mixers:
             #self.remove_page(mixer.frame)
@@ -76,21 +88,81 @@ class MixersContainer(gtk.Notebook):
             
     def set_default_page(self):
         default_card_index = self.config.getint(self.config.get_default_section(), "card_index")
-        log.Notice("set default page %s" % default_card_index)
-        self.set_current_page(default_card_index)
+        log.Notice("set default page %s", default_card_index)
+        for mixer in self.mixers:
+            if ( mixer.card_index == default_card_index ):
+                self.set_current_page(self.page_num(mixer.frame))
+        self.update_connections()
         
     def add_mixer(self, mixer):
-        self.append_page(mixer.frame, gtk.Label(mixer.card_name))
-        self.mixers.append(mixer)
+        """ Adds mixer page, pages are ordered by card index """
+        position = len([m for m in self.mixers if m.card_index < mixer.card_index])
+        self.insert_page(mixer.frame, gtk.Label(mixer.card_name), position)
+        self.mixers.insert(position, mixer)
         
     def del_mixer(self, mixer):
-        self.remove_page(mixer.frame)
+        mixer.save()
+        mixer.close()
+        self.remove_page(self.page_num(mixer.frame))
+        mixer.frame.destroy()
         self.mixers.remove(mixer)
         del mixer
 
     def init(self):
         for card_index, card_name in enumerate(CardInfo.get_cards()):
-            self.add_mixer(Mixer(self.config, card_index, card_name))
+            if ( card_name != None ):
+                self.add_mixer(Mixer(self.config, card_index, card_name))
+        #connected after pages are added, so first page is not populated unless it is default one
+        self.connect("switch-page", self.on_switch_page)
+        
+    def get_mixer(self, page_num):
+        frame = self.get_nth_page(page_num)
+        for mixer in self.mixers:
+            if ( mixer.frame == frame ):
+                return mixer
+        return None
+        
+    def on_switch_page(self, notebook, page, page_num):
+        #current page is not changed yet
+        self.update_connections(page_num)
+        
+    def set_shown(self, shown):
+        """ Stops polling while window is hidden or minimized """
+        if ( shown != self.shown ):
+            self.shown = shown
+            self.update_connections()
+    
+    def update_connections(self, page_num = None):
+        """ Polls visible page only, page is refreshed from fresh read when it becomes visible """
+        if ( page_num == None ):
+            page_num = self.get_current_page()
+        visible = None
+        if (self.shown):
+            visible = self.get_mixer(page_num)
+            
+        for mixer in self.mixers:
+            if ( mixer != visible and mixer.connected ):
+                mixer.disconnect()
+        if ( visible and not visible.connected ):
+            log.Notice("poll mixer %s:%s", visible.card_index, visible.card_name)
+            visible.populate()
+            visible.connect()
+            visible.refresh()
+    
+    def on_cards_changed(self, cards):
+        """ Removes pages of gone or renumbered cards, adds pages for new ones """
+        for mixer in list(self.mixers):
+            if ( CardInfo.get_card_id(mixer.card_index) != mixer.card_name ):
+                log.Notice("removing mixer %s:%s", mixer.card_index, mixer.card_name)
+                self.del_mixer(mixer)
+        
+        indexes = [mixer.card_index for mixer in self.mixers]
+        for card_index, card_name in enumerate(cards):
+            if ( card_name != None and card_index not in indexes ):
+                log.Notice("adding mixer %s:%s", card_index, card_name)
+                self.add_mixer(Mixer(self.config, card_index, card_name))
+        self.show_all()
+        self.update_connections()
 
     def save(self):
         for mixer in self.mixers:
@@ -100,13 +172,6 @@ class MixersContainer(gtk.Notebook):
         for mixer in self.mixers:
             mixer.load()
 
-    def on_change(self, source=None, condition=None):
-        #gtk.gdk.threads_enter()
-        for mixer in self.mixers:
-            mixer.on_change()
-        return True
-        #gtk.gdk.threads_leave()
-    
 class MixersWindow(gtk.Window):
     """ Volti Mixer Application"""
 
@@ -120,13 +185,28 @@ class MixersWindow(gtk.Window):
         self.mixerscontainer.init()
         self.add_events(gtk.gdk.BUTTON_PRESS_MASK)
         self.connect('delete_event', self.quit)
-        self.show_all()
+        self.connect("map", self.on_map)
+        self.connect("unmap", self.on_unmap)
+        self.connect("window-state-event", self.on_window_state_event)
+        #pages must be shown to become current, default page is selected before window is mapped
+        self.mixerscontainer.show_all()
         self.mixerscontainer.set_default_page()
+        self.show_all()
 
     def __del__(self):
         log.Notice("deleting main window")
         del self.mixerscontainer
 
+    def on_map(self, widget):
+        self.mixerscontainer.set_shown(True)
+        
+    def on_unmap(self, widget):
+        self.mixerscontainer.set_shown(False)
+        
+    def on_window_state_event(self, widget, event):
+        hidden = gtk.gdk.WINDOW_STATE_ICONIFIED | gtk.gdk.WINDOW_STATE_WITHDRAWN
+        self.mixerscontainer.set_shown(not (event.new_window_state & hidden))
+        
     def _set_icon_name_file(self, name="multimedia-volume-control"):
         icon_theme = gtk.icon_theme_get_default()
         if icon_theme.has_icon(name):
@@ -148,10 +228,11 @@ class MixersWindow(gtk.Window):
 class MixersApplication(ApplicationAbstract):
     def __init__(self):
         self.config = Config()
+        MixerHandler.configure(self.config)
         self.mixer = MixersWindow(self.config)
 
     def __del__(self):
         log.Notice("deleting app window")
-        self.config.save()
+        self.config.flush()
         del self.config
         del self.mixer
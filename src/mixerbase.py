@@ -17,10 +17,111 @@
 
 from debug import log
 from abc import abstractmethod
+from threading import Thread, Condition
+import Queue
+import time
+from array import array
+from operator import ne
 import gobject
+import gio
 import alsaaudio as alsa
+from mixerio import MixerIO
+from metrics import Metrics
+from collections import namedtuple
+
+#immutable control state, rebuilt on every read or write
+MixerStatus = namedtuple("MixerStatus", "volume muted var card_name mixer_name rec")
+
+class MixerHandle:
+    """ Opened mixer element, shared by all channels of the same control. Used in mixer thread only """
+    #pyalsaaudio without handleevents can't update element values in opened mixer
+    refresh_in_place = hasattr(alsa.Mixer, "handleevents")
+    handles = {}
+    
+    @staticmethod
+    def open(card_index, control, cid):
+        key = (card_index, control, cid)
+        handle = MixerHandle.handles.get(key)
+        if ( not handle ):
+            handle = MixerHandle(key)
+            MixerHandle.handles[key] = handle
+        handle.refs += 1
+        return handle
+    
+    def __init__(self, key):
+        self.key = key
+        self.refs = 0
+        self.element = None
+        #incremented in main loop for every queued write, readers skip samples older than last write
+        self.write_seq = 0
+        self.applied_seq = 0
+        self.reopen()
+        
+    def __getattr__(self, name):
+        return getattr(self.element, name)
+    
+    def reopen(self):
+        (card_index, control, cid) = self.key
+        element = alsa.Mixer(control=control, cardindex = card_index, id = cid)
+        if (self.element):
+            self.element.close()
+        self.element = element
+        
+    def refresh(self):
+        """ Updates element values in place, reopens mixer only if handle is stale """
+        if ( self.refresh_in_place ):
+            try:
+                self.element.handleevents()
+                return True
+            except Exception, err:
+                log.Warn("Mixer %s:%s is stale: %s", self.key[0], self.key[1], str(err))
+        try:
+            self.reopen()
+        except Exception, err:
+            log.Warn("Can't reopen mixer: %s", str(err))
+            return False
+        return True
+    
+    def write(self, kind, func, *args):
+        """ Queues func(handle, *args) in mixer thread, replaces pending write of the same kind """
+        self.write_seq += 1
+        MixerIO.write((self.key, kind), self._apply, self.write_seq, func, args)
+        
+    def _apply(self, seq, func, args):
+        try:
+            func(self, *args)
+        finally:
+            self.applied_seq = seq
+    
+    @staticmethod
+    def drop(card_index):
+        """ Forgets handles of removed card, holders keep theirs until closed """
+        for key in MixerHandle.handles.keys():
+            if ( key[0] == card_index ):
+                del MixerHandle.handles[key]
+    
+    def close(self):
+        """ Releases handle, mixer is closed with the last reference """
+        self.refs -= 1
+        if ( self.refs > 0 ):
+            return
+        if ( MixerHandle.handles.get(self.key) is self ):
+            del MixerHandle.handles[self.key]
+        if (self.element):
+            self.element.close()
+            self.element = None
 
 class MixerChannel:
+    """
+    Mixer control. Getters return state cached in main loop, setters queue writes
+    in mixer thread, read_* methods touch hardware and run in mixer thread
+    """
+    mixer = None
+    #incremented by every update and close, result of older open is dropped
+    open_seq = 0
+    #time of sample, in which last external change was detected
+    changed_at = None
+    
     def __init__(self, card_index, control = "Master", cid = 0, emulate_mute = False):
         MixerChannel.update(self, card_index, control, cid, emulate_mute)
         
@@ -30,63 +131,137 @@ class MixerChannel:
     def update(self, card_index, control, cid , emulate_mute = False):
         
         self.channel = alsa.MIXER_CHANNEL_ALL
-        self.mixer = None
+        self.close()
         self._lock = True
         self._muted = False
         self.last_mute = False
-        self.channel_count = 1
+        self.last_rec = None
+        self.card_name = ""
+        self.mixer_name = ""
         
         self.card_index = card_index
         self.control = control
         self.cid = cid
         self.emulate_mute = emulate_mute
         
-        self.reopen()
+        #placeholder state until mixer is opened in mixer thread
+        self.channel_count = CardInfo.get_channel_count(card_index, control, cid)
+        self.last_volume = [0] * self.channel_count
+        self.old_volume = self.last_volume
+        self.update_status()
+        
+        MixerIO.read(self._open, self.on_opened, self.open_seq, card_index, control, cid)
         
-        self.last_volume = self.get_volume()
+    def _open(self, seq, card_index, control, cid):
+        """ Runs in mixer thread, opens mixer and reads initial state """
+        start = time.time()
+        try:
+            handle = MixerHandle.open(card_index, control, cid)
+            Metrics.observe("alsa.open", start)
+        except Exception, err:
+            log.Warn("Can't get mixer: %s", str(err))
+            return (seq, None)
+        
+        state = {"handle": handle,
+                 "volume": self.read_volume(handle),
+                 "mute": self.read_mute(handle),
+                 "rec": self.read_rec(handle),
+                 "card_name": "",
+                 "mixer_name": ""}
+        try:
+            state["card_name"] = handle.cardname()
+            state["mixer_name"] = handle.mixer()
+        except Exception, err:
+            log.Warn("Can't get mixer names: %s", str(err))
+        return (seq, state)
+        
+    def on_opened(self, result):
+        (seq, state) = result
+        if ( seq != self.open_seq ):
+            #control was updated or closed while mixer was opening
+            if (state):
+                MixerIO.post(state["handle"].close)
+            return
+        if ( not state ):
+            return
+        
+        self.mixer = state["handle"]
+        self.last_volume = state["volume"]
         self.old_volume = self.last_volume
         self.channel_count = len(self.last_volume)
+        self.last_mute = state["mute"]
+        self.last_rec = state["rec"]
+        self.card_name = state["card_name"]
+        self.mixer_name = state["mixer_name"]
+        self.update_status()
+        self.on_open()
+        
+    def on_open(self):
+        """ Called in main loop, when mixer is opened and state is read """
+        pass
         
     def get_status_info(self):
-        """ Returns status information """
-        volume = self.get_volume()
-        muted = self.get_mute()
+        """ Returns status snapshot """
+        return self.status
+    
+    def update_status(self):
+        volume = tuple(self.last_volume)
+        muted = self.last_mute
         
         if ( not volume[0] or muted ):
             var = ""
         else:
             var = "%"
             
-        card_name = self.mixer.cardname()
-        mixer_name = self.mixer.mixer()
-        return [volume, muted, var, card_name, mixer_name]
+        self.status = MixerStatus(volume, muted, var, self.card_name, self.mixer_name, self.last_rec)
     
-    def reopen(self):
-        self.close()
-        try:
-            self.mixer = alsa.Mixer(control=self.control, cardindex = self.card_index, id = self.cid)
-        except Exception, err:
-            log.Error("Can't get mixer: %s" % (str(err)) )
+    def refresh(self):
+        """ Updates element values of opened mixer """
+        if ( not self.mixer ):
+            return False
+        return self.mixer.refresh()
+    
+    def sample(self):
+        """ Returns fresh volume, mute and rec state, rec is None for control without capture switch """
+        self.refresh()
+        rec = None
+        if ( self.last_rec is not None ):
+            rec = self.read_rec()
+        return (self.read_volume(), self.read_mute(), rec)
 
     def close(self):
+        self.open_seq += 1
         if (self.mixer):
-            self.mixer.close()
+            MixerIO.post(self.mixer.close)
             self.mixer = None
             
+    def write(self, kind, func, *args):
+        """ Queues write, it is dropped while mixer is not opened yet """
+        if (self.mixer):
+            self.mixer.write(kind, func, *args)
+            
     def set_rec(self, value):
+        self.last_rec = value
+        self.update_status()
+        self.write("rec", self._write_rec, int(value))
         
+    def _write_rec(self, mixer, value):
         try:
-            self.mixer.setrec(int(value))
+            mixer.setrec(value)
         except:
             log.Warn("Can't set rec")
-        
 
     def set_mute(self, value):
+        self.last_mute = value
+        self.update_status()
+        self.write("mute", self._write_mute, value)
+        
+    def _write_mute(self, mixer, value):
         if ( not self.emulate_mute ):
             
             try:
-                self.mixer.setmute(int(value))
-                assert self.get_mute() == value
+                mixer.setmute(int(value))
+                assert (mixer.getmute()[0] == 1) == value
             except:
                 log.Notice("set emulate to on")
                 self.emulate_mute  = True
@@ -95,39 +270,55 @@ class MixerChannel:
         if ( self.emulate_mute ):
             if ( value ):
                 self._muted = False
-                self.old_volume = self.mixer.getvolume()
-                
-                volume = [0] * self.get_channel_count(); 
-                for i, vol in enumerate(volume):
-                    self.mixer.setvolume(vol, i)
-                    
+                self.old_volume = mixer.getvolume()
+                self._write_channels(mixer, [0] * self.get_channel_count())
                 self._muted = True
             else:
                 self._muted = False
-                for i, vol in enumerate(self.old_volume):
-                    self.mixer.setvolume(vol, i)
-                    
-        self.last_mute = value
+                self._write_channels(mixer, self.old_volume)
 
     def set_lock(self, value):
-        log.Notice("sets lock for %s to %s" % (self.control, value) )
+        log.Notice("sets lock for %s to %s", self.control, value)
         self._lock = value
 
     def set_volume(self, volume, channel = None):
-        """ Set the playback volume """
-        if ( channel == None ):
-            volume = [volume] * self.get_channel_count(); 
-            for i, vol in enumerate(volume):
-                self.mixer.setvolume(vol, i)
-                self.last_volume[i] = vol
+        """ Set the playback volume, volume is a value for all channels or list of per-channel values """
+        if ( isinstance(volume, list) ):
+            self.last_volume = list(volume)
+            self.write(("volume", None), self._write_channels, list(self.last_volume))
+        elif ( channel == None ):
+            self.last_volume = [volume] * self.get_channel_count()
+            self.write(("volume", None), self._write_channels, list(self.last_volume))
         else:
-            self.mixer.setvolume(volume, channel)
+            self.last_volume = list(self.last_volume)
             self.last_volume[channel] = volume
+            self.write(("volume", channel), self._write_channel, volume, channel)
+        self.update_status()
+            
+    def _write_channel(self, mixer, volume, channel):
+        start = time.time()
+        mixer.setvolume(volume, channel)
+        Metrics.observe("alsa.setvolume", start)
+        
+    def _write_channels(self, mixer, volume):
+        start = time.time()
+        if ( volume.count(volume[0]) == len(volume) ):
+            mixer.setvolume(volume[0], self.channel)
+        else:
+            #pyalsaaudio can't write different values in one call
+            for i, vol in enumerate(volume):
+                mixer.setvolume(vol, i)
+        Metrics.observe("alsa.setvolume", start)
         
     def get_rec(self):
+        return self.last_rec
+        
+    def read_rec(self, mixer = None):
+        if ( mixer is None ):
+            mixer = self.mixer
         ret = None
         try:
-            record = self.mixer.getrec()
+            record = mixer.getrec()
             ret = record[0]
         except:
             pass
@@ -135,12 +326,19 @@ class MixerChannel:
         return ret
     
     def get_mute(self):
+        return self.last_mute
+    
+    def read_mute(self, mixer = None):
+        if ( mixer is None ):
+            mixer = self.mixer
         mute = False
         if (not self.emulate_mute):
+            start = time.time()
             try:
-                mute = self.mixer.getmute()[0] == 1
+                mute = mixer.getmute()[0] == 1
+                Metrics.observe("alsa.getmute", start)
             except:
-                volume = self.get_volume()
+                volume = self.read_volume(mixer)
                 if ( isinstance(volume, list) ):
                     volume = int(volume[0]) 
                 self._muted = volume == 0
@@ -159,13 +357,20 @@ class MixerChannel:
         
     def get_volume(self):
         """ Get the current sound card setting for specified channel """
+        return list(self.last_volume)
+    
+    def read_volume(self, mixer = None):
+        if ( mixer is None ):
+            mixer = self.mixer
         if (self._muted):
             volume = self.old_volume
         else:
+            start = time.time()
             try:
-                volume = self.mixer.getvolume()
+                volume = mixer.getvolume()
+                Metrics.observe("alsa.getvolume", start)
             except Exception, err:
-                log.Warn("Can't get volume: %s" % (str(err)) )
+                log.Warn("Can't get volume: %s", str(err))
                 volume = [0] * self.get_channel_count()
             
         return volume
@@ -173,71 +378,636 @@ class MixerChannel:
     def get_channel_count(self):
         return self.channel_count
     
-    def get_volumecap(self):
-        vc = None
-        
-        try:
-            vc = self.mixer.volumecap()
-        except:
-            log.Warn("Can't get volumecap")
-            vc = None
-        return vc
-
-    def get_descriptors(self):
-        """ Returns file descriptors """
-        desc = None
-        
-        try:
-            desc = self.mixer.polldescriptors()[0]
-        except:
-            desc = [None, None]
-        
-        return desc
-
 class CardInfo():
+    """ Card and control topology, probed once and cached until card set changes """
+    probe_threads = 4
+    probe_timeout = 2.0
+    card_ids = None
+    cards = None
+    topology = {}
+    
+    @staticmethod
+    def invalidate():
+        log.Notice("card topology invalidated")
+        CardInfo.card_ids = None
+        CardInfo.cards = None
+        CardInfo.topology = {}
+    
     @staticmethod
     def get_cards():
         """ Returns cards list """
-        cards = []
-        acards = alsa.cards()
-        log.Notice("getting card list", 1)
-        for index, card in enumerate(acards):
-            try:
-                assert len (CardInfo.get_mixers(index)) > 0
-            except IndexError, err:
-                log.Warn("Card error: %s" % str(err))
-                cards.append(None)
-            else:
+        acards = CardInfo.get_card_ids()
+        if ( acards != CardInfo.card_ids ):
+            CardInfo.invalidate()
+            CardInfo.card_ids = acards
+            
+        if ( CardInfo.cards == None ):
+            log.Notice("getting card list", depth = 1)
+            indexes = [index for index, card in enumerate(acards) if card != None and index not in CardInfo.topology]
+            for index, topology in zip(indexes, CardInfo._probe_cards(indexes)):
+                #timed out card is cached as unavailable until invalidate, so it isn't probed in main loop
+                CardInfo.topology[index] = topology or []
+            
+            cards = []
+            for index, card in enumerate(acards):
+                if ( card != None and not CardInfo.topology.get(index) ):
+                    log.Warn("Card %s:%s is not available", index, card)
+                    card = None
                 cards.append(card)
-        return cards
+            CardInfo.cards = cards
+        return list(CardInfo.cards)
+    
+    @staticmethod
+    def get_card_ids():
+        """ Returns card ids indexed by alsa card number, None for unused numbers """
+        acards = alsa.cards()
+        if ( hasattr(alsa, "card_indexes") ):
+            indexes = alsa.card_indexes()
+        else:
+            indexes = range(len(acards))
+        ids = [None] * (max(indexes or [-1]) + 1)
+        for index, card in zip(indexes, acards):
+            ids[index] = card
+        return ids
+    
+    @staticmethod
+    def get_card_id(card_index):
+        """ Returns stable id of card, None if card is not available """
+        cards = CardInfo.get_cards()
+        if ( 0 <= card_index < len(cards) ):
+            return cards[card_index]
+        return None
+    
+    @staticmethod
+    def get_card_index(card_id):
+        """ Returns current index of card, None if card is not available """
+        cards = CardInfo.get_cards()
+        if ( card_id in cards ):
+            return cards.index(card_id)
+        return None
+    
+    @staticmethod
+    def get_default_card_index():
+        """ Returns index of first available card """
+        for index, card in enumerate(CardInfo.get_cards()):
+            if ( card != None ):
+                return index
+        return None
     
     @staticmethod
     def get_mixers(card_index=0):
         """ Returns mixers list """
+        return [[control, cid] for control, cid, caps, channel_count in CardInfo.get_topology(card_index)]
+    
+    @staticmethod
+    def get_channel_count(card_index, control, cid):
+        """ Returns channel count from cached topology without probing, 1 if card is not probed yet """
+        for topology_control, topology_cid, caps, channel_count in CardInfo.topology.get(card_index) or []:
+            if ( topology_control == control and topology_cid == cid ):
+                return channel_count
+        return 1
+    
+    @staticmethod
+    def get_topology(card_index=0):
+        """ Returns list of (control, cid, caps, channel_count) for controls with volume """
+        topology = CardInfo.topology.get(card_index)
+        if ( topology == None ):
+            #probe is bounded by timeout, timed out card has no controls
+            topology = CardInfo._probe_cards([card_index])[0] or []
+            CardInfo.topology[card_index] = topology
+        return topology
+    
+    @staticmethod
+    def _probe_cards(indexes):
+        """ Probes cards in thread pool, returns topologies in card order, None for timed out cards """
+        queue = Queue.Queue()
+        started = {}
+        results = {}
+        done = Condition()
+        
+        def worker():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                started[index] = time.time()
+                try:
+                    topology = CardInfo._probe(index)
+                except Exception, err:
+                    log.Warn("Card error: %s", str(err))
+                    topology = []
+                done.acquire()
+                results[index] = topology
+                done.notify()
+                done.release()
+        
+        def spawn():
+            thread = Thread(target = worker)
+            thread.setDaemon(True)
+            thread.start()
+        
+        for index in indexes:
+            queue.put(index)
+        for i in range(min(CardInfo.probe_threads, len(indexes))):
+            spawn()
+        
+        topologies = []
+        done.acquire()
+        for index in indexes:
+            while ( index not in results ):
+                start = started.get(index)
+                if ( start and time.time() - start > CardInfo.probe_timeout ):
+                    log.Warn("Card %s probe timed out", index)
+                    #stuck thread keeps its slot, replace it for the rest of cards
+                    spawn()
+                    break
+                done.wait(0.1)
+            topologies.append(results.get(index))
+        done.release()
+        return topologies
+    
+    @staticmethod
+    def _probe(card_index):
         mixers_tmp = []
-        mixers_params = []
+        topology = []
         for control in alsa.mixers(card_index):
             cid = mixers_tmp.count(control)
-            mixer = MixerChannel(card_index, control, cid)
-            cap = mixer.get_volumecap()
+            try:
+                mixer = alsa.Mixer(control=control, cardindex = card_index, id = cid)
+            except Exception, err:
+                log.Warn("Can't get mixer: %s", str(err))
+                continue
+            try:
+                cap = mixer.volumecap()
+                channel_count = len(mixer.getvolume())
+            except:
+                cap = None
+            mixer.close()
             if ( cap ):
                 #if 'Playback Volume' in cap or 'Joined Volume' in cap:
-                item = [control, cid]
-                mixers_params.append(item)
+                topology.append( (control, cid, tuple(cap), channel_count) )
                 mixers_tmp.append(control)
-            del mixer
-        return mixers_params
+        return topology
+
+class PollScheduler:
+    """ Polls handlers, backs off to idle interval while nothing changes """
+    def __init__(self):
+        self.handlers = []
+        self.source = None
+        self.holds = 0
+        self.idle_ticks = 0
+        self.set_policy(200, 4000, 10)
+        
+    def set_policy(self, interval, idle_interval, backoff_ticks):
+        """ Sets fast and idle intervals in ms, unchanged ticks before each interval doubling """
+        self.fast = max(10, interval)
+        self.slow = max(self.fast, idle_interval)
+        self.backoff = max(1, backoff_ticks)
+        self.interval = self.fast
+        self.idle_ticks = 0
+        self.schedule()
+        
+    def add(self, handler):
+        self.handlers.append(handler)
+        self.kick()
+        if ( not self.source ):
+            self.schedule()
+        
+    def remove(self, handler):
+        if ( handler in self.handlers ):
+            self.handlers.remove(handler)
+        if ( not self.handlers ):
+            self.schedule()
+            
+    def hold(self, active):
+        """ Keeps fast interval while held, i.e. while slider popup is shown """
+        if (active):
+            self.holds += 1
+            self.kick()
+        else:
+            self.holds = max(0, self.holds - 1)
+    
+    def kick(self):
+        """ Snaps back to fast interval """
+        self.idle_ticks = 0
+        if ( self.interval != self.fast ):
+            self.interval = self.fast
+            self.schedule()
+    
+    def schedule(self):
+        if (self.source):
+            gobject.source_remove(self.source)
+            self.source = None
+        if ( not self.handlers ):
+            return
+        if ( self.interval >= 1000 ):
+            #second granularity timers are coalesced with other wakeups by glib
+            self.source = gobject.timeout_add_seconds(self.interval / 1000, self.on_tick)
+        else:
+            self.source = gobject.timeout_add(self.interval, self.on_tick)
+        
+    def on_tick(self):
+        changed = False
+        start = time.time()
+        for handler in list(self.handlers):
+            if ( handler() ):
+                changed = True
+        Metrics.observe("poll.tick", start)
+        
+        interval = self.interval
+        if ( changed or self.holds ):
+            self.idle_ticks = 0
+            interval = self.fast
+        else:
+            self.idle_ticks += 1
+            if ( self.idle_ticks >= self.backoff ):
+                self.idle_ticks = 0
+                interval = min(self.interval * 2, self.slow)
+        
+        if ( interval != self.interval ):
+            self.interval = interval
+            #current source is destroyed by returning False
+            self.source = None
+            self.schedule()
+            return False
+        return True
+
+class MixerWatch:
+    """ Calls handler on card mixer events, polls if backend can't deliver events """
+    def __init__(self, handler, card_index = None):
+        self.handler = handler
+        self.card_index = card_index
+        self.mixer = None
+        self.descriptors = []
+        self.sources = []
+        self.polling = False
+        self.closed = False
+        #without snd_mixer_handle_events pending events are never acknowledged
+        #and descriptors stays readable, so watch repeats infinitely after first event
+        if ( card_index == None or not hasattr(alsa.Mixer, "handleevents") ):
+            self.poll()
+        else:
+            MixerIO.read(self._open, self.on_opened, card_index)
+            
+    def __del__(self):
+        self.close()
+        
+    def _open(self, card_index):
+        """ Runs in mixer thread, returns mixer and its descriptors """
+        try:
+            control = alsa.mixers(card_index)[0]
+            mixer = alsa.Mixer(control=control, cardindex = card_index)
+            return (mixer, mixer.polldescriptors())
+        except Exception, err:
+            log.Warn("Can't watch mixer events: %s", str(err))
+            return (None, [])
+        
+    def on_opened(self, result):
+        (mixer, descriptors) = result
+        if (self.closed):
+            if (mixer):
+                MixerIO.post(mixer.close)
+            return
+        self.mixer = mixer
+        self.descriptors = descriptors
+        if ( not self.watch() ):
+            self.fail("no mixer descriptors")
+        
+    def watch(self):
+        """ Adds io watches on mixer descriptors, returns False if there is nothing to watch """
+        for fd, eventmask in self.descriptors:
+            condition = eventmask | gobject.IO_ERR | gobject.IO_HUP
+            self.sources.append(gobject.io_add_watch(fd, condition, self.on_event))
+        return len(self.sources) > 0
+    
+    def unwatch(self):
+        for source in self.sources:
+            gobject.source_remove(source)
+        self.sources = []
+    
+    def poll(self):
+        self.polling = True
+        MixerHandler.scheduler.add(self.handler)
+        
+    def fail(self, reason):
+        log.Warn("Mixer events lost, polling card %s: %s", self.card_index, reason)
+        self.close()
+        self.poll()
+    
+    def close(self):
+        self.closed = True
+        self.unwatch()
+        if (self.polling):
+            self.polling = False
+            MixerHandler.scheduler.remove(self.handler)
+        if (self.mixer):
+            MixerIO.post(self.mixer.close)
+            self.mixer = None
+            
+    def on_event(self, source, condition):
+        #events are acknowledged in mixer thread, descriptors stay readable until then
+        self.unwatch()
+        if ( condition & (gobject.IO_ERR | gobject.IO_HUP) ):
+            self.fail("mixer descriptor closed")
+        else:
+            MixerIO.read(self._handle_events, self.on_handled, self.mixer)
+        return False
+    
+    def _handle_events(self, mixer):
+        """ Runs in mixer thread, returns error or None """
+        try:
+            mixer.handleevents()
+        except Exception, err:
+            return err
+        return None
+        
+    def on_handled(self, err):
+        if (self.closed):
+            return
+        if (err):
+            self.fail(str(err))
+            return
+        Metrics.count("mixer.events")
+        self.watch()
+        self.handler()
+
+class CardMonitor:
+    """ Watches sound devices, calls hook with new cards list after hotplug """
+    paths = ["/dev/snd", "/proc/asound"]
+    delay = 500
+    
+    def __init__(self, hook):
+        self.hook = hook
+        self.source = None
+        self.monitors = []
+        for path in self.paths:
+            try:
+                monitor = gio.File(path).monitor_directory()
+            except Exception, err:
+                log.Warn("Can't monitor %s: %s", path, str(err))
+                continue
+            monitor.connect("changed", self.on_changed)
+            self.monitors.append(monitor)
+            
+    def close(self):
+        for monitor in self.monitors:
+            monitor.cancel()
+        self.monitors = []
+        if (self.source):
+            gobject.source_remove(self.source)
+            self.source = None
+    
+    def on_changed(self, monitor, file, other_file, event_type):
+        name = file.get_basename()
+        if ( not name.startswith("controlC") and not name.startswith("card") ):
+            return
+        #udev creates device nodes one by one, wait until card is settled
+        if (self.source):
+            gobject.source_remove(self.source)
+        self.source = gobject.timeout_add(self.delay, self.on_settled)
+        
+    def on_settled(self):
+        self.source = None
+        old_ids = CardInfo.card_ids or []
+        ids = CardInfo.get_card_ids()
+        if ( ids == old_ids ):
+            return False
+        
+        log.Notice("cards changed: %s -> %s", old_ids, ids)
+        for index in range(max(len(ids), len(old_ids))):
+            if ( index >= len(ids) or index >= len(old_ids) or ids[index] != old_ids[index] ):
+                MixerIO.post(MixerHandle.drop, index)
+                MixerHandler.rewatch(index, index < len(ids) and ids[index] != None)
+        CardInfo.invalidate()
+        self.hook(CardInfo.get_cards())
+        return False
+
+class ControlView(object):
+    """ Slot of one control in card state arrays """
+    __slots__ = ("key", "channel", "offset", "count")
+    
+    def __init__(self, key, channel, offset, count):
+        self.key = key
+        self.channel = channel
+        self.offset = offset
+        self.count = count
+
+class CardSampler:
+    """ Reads every subscribed control of a card once per tick, fans changed ones out to subscribers """
+    def __init__(self, card_index):
+        self.card_index = card_index
+        self.subscribers = {}
+        self.reading = False
+        self.views = None
+        #last dispatched state, volumes of all controls are packed in one array
+        #rec is -1 for controls without capture switch
+        self.volumes = array("i")
+        self.mutes = array("b")
+        self.recs = array("b")
+        self.seqs = array("l")
+        self.watch = MixerWatch(self.on_change, card_index)
+        
+    def close(self):
+        if (self.watch):
+            self.watch.close()
+            
+    def rewatch(self, present):
+        """ Watches new card at the same index, removed card is not watched or polled until it is back """
+        self.close()
+        self.watch = None
+        if (present):
+            self.watch = MixerWatch(self.on_change, self.card_index)
+        #layout and state of old card are dropped, next read is dispatched in full
+        self.views = None
+        
+    def subscribe(self, control):
+        key = (control.control, control.cid)
+        self.subscribers.setdefault(key, []).append(control)
+        self.views = None
+        
+    def unsubscribe(self, control):
+        """ Returns count of controls still subscribed """
+        key = (control.control, control.cid)
+        controls = self.subscribers.get(key, [])
+        if ( control in controls ):
+            controls.remove(control)
+        if ( not controls ):
+            self.subscribers.pop(key, None)
+        self.views = None
+        return len(self.subscribers)
+        
+    def get_views(self):
+        """ Packs subscribed controls into state arrays, old state is dropped so next read is dispatched """
+        if ( self.views is None ):
+            self.views = []
+            offset = 0
+            for key, controls in self.subscribers.items():
+                count = controls[0].get_channel_count()
+                self.views.append(ControlView(key, controls[0], offset, count))
+                offset += count
+            self.volumes = array("i")
+            self.mutes = array("b")
+            self.recs = array("b")
+            self.seqs = array("l")
+        return self.views
+        
+    def on_change(self):
+        """ Queues read in mixer thread, changes are dispatched when it is done """
+        if ( not self.reading ):
+            self.reading = True
+            MixerIO.read(self.sample, self.dispatch, self.get_views())
+        return False
+    
+    def sample(self, views):
+        """ Runs in mixer thread, returns None on error """
+        try:
+            return self._sample(views)
+        except Exception, err:
+            log.Warn("Can't sample card %s: %s", self.card_index, str(err))
+            return None
+    
+    def _sample(self, views):
+        start = time.time()
+        handles = []
+        volumes = array("i")
+        mutes = array("b")
+        recs = array("b")
+        seqs = array("l")
+        for view in views:
+            handle = view.channel.mixer
+            if ( handle ):
+                seq = handle.applied_seq
+                (volume, mute, rec) = view.channel.sample()
+                if ( len(volume) != view.count ):
+                    #control was reopened with other channel count
+                    return (views, None, None, None, None, None, start)
+            else:
+                (seq, volume, mute, rec) = (-1, [0] * view.count, False, None)
+            handles.append(handle)
+            volumes.extend(volume)
+            mutes.append(mute)
+            if ( rec is None ):
+                recs.append(-1)
+            else:
+                recs.append(int(bool(rec)))
+            seqs.append(seq)
+        Metrics.observe("poll.sample", start)
+        Metrics.count("poll.controls", len(views))
+        return (views, handles, volumes, mutes, recs, seqs, start)
+    
+    def dispatch(self, samples):
+        self.reading = False
+        if ( samples is None ):
+            return
+        (views, handles, volumes, mutes, recs, seqs, sampled) = samples
+        if ( views is not self.views ):
+            #subscribers changed while reading, result doesn't match layout
+            self.on_change()
+            return
+        if ( handles is None ):
+            self.views = None
+            self.on_change()
+            return
+        
+        #whole card in one compare, nothing to do in most ticks
+        if ( volumes == self.volumes and mutes == self.mutes and recs == self.recs and seqs == self.seqs ):
+            return
+        
+        mask = self.get_changed_mask(volumes, mutes, recs, seqs)
+        changed = False
+        for index, view in enumerate(views):
+            if ( not mask[index] ):
+                continue
+            handle = handles[index]
+            #sample is older than pending write, next one will be fresh
+            if ( not handle or handle.write_seq != seqs[index] ):
+                seqs[index] = -1
+                continue
+            volume = volumes[view.offset:view.offset + view.count].tolist()
+            mute = bool(mutes[index])
+            rec = None
+            if ( recs[index] >= 0 ):
+                rec = bool(recs[index])
+            for control in self.subscribers.get(view.key, []):
+                if ( control.mixer is handle and control.on_sample(volume, mute, rec) ):
+                    control.changed_at = sampled
+                    changed = True
+        
+        self.volumes = volumes
+        self.mutes = mutes
+        self.recs = recs
+        self.seqs = seqs
+        if (changed):
+            MixerHandler.kick()
+            
+    def get_changed_mask(self, volumes, mutes, recs, seqs):
+        """ Returns flag for every view, whose state differs from last dispatched one """
+        if ( len(volumes) != len(self.volumes) ):
+            return [True] * len(mutes)
+        mask = map(ne, mutes, self.mutes)
+        #local writes change seq, such controls are confirmed against hardware too
+        for other, last in ( (recs, self.recs), (seqs, self.seqs) ):
+            for index, changed in enumerate(map(ne, other, last)):
+                if (changed):
+                    mask[index] = True
+        if ( volumes != self.volumes ):
+            for index, view in enumerate(self.views):
+                if ( not mask[index] ):
+                    start = view.offset
+                    end = start + view.count
+                    mask[index] = volumes[start:end] != self.volumes[start:end]
+        return mask
 
-class MixerHandler:    
+class MixerHandler:
+    scheduler = PollScheduler()
+    samplers = {}
+    
+    @staticmethod
+    def configure(config):
+        snapshot = config.get_snapshot()
+        MixerHandler.scheduler.set_policy(snapshot.poll_interval,
+                                          snapshot.poll_interval_idle,
+                                          snapshot.poll_backoff_ticks)
+    
+    @staticmethod
+    def hold(active):
+        MixerHandler.scheduler.hold(active)
+        
     @staticmethod
-    def connect(handler):
-        log.Notice("connect handler", 1)
-        return gobject.timeout_add(200, handler)
+    def kick():
+        MixerHandler.scheduler.kick()
     
     @staticmethod
-    def disconnect(handle):
-        log.Notice("disconnect handler", 1)
-        gobject.source_remove(handle)
+    def sample(card_index):
+        """ Reads card now instead of waiting for event or tick """
+        sampler = MixerHandler.samplers.get(card_index)
+        if (sampler):
+            sampler.on_change()
+    
+    @staticmethod
+    def subscribe(control):
+        log.Notice("subscribe %s:%s", control.card_index, control.control, depth = 1)
+        sampler = MixerHandler.samplers.get(control.card_index)
+        if ( not sampler ):
+            sampler = CardSampler(control.card_index)
+            MixerHandler.samplers[control.card_index] = sampler
+        sampler.subscribe(control)
+    
+    @staticmethod
+    def rewatch(card_index, present):
+        """ Restores event watching after card at card_index is removed or replaced """
+        sampler = MixerHandler.samplers.get(card_index)
+        if (sampler):
+            sampler.rewatch(present)
+    
+    @staticmethod
+    def unsubscribe(control):
+        log.Notice("unsubscribe %s:%s", control.card_index, control.control, depth = 1)
+        sampler = MixerHandler.samplers.get(control.card_index)
+        if ( sampler and not sampler.unsubscribe(control) ):
+            sampler.close()
+            del MixerHandler.samplers[control.card_index]
 
 class MixerControlAbstract(MixerChannel):
     def __init__(self, card_index = 0, control = "Master", cid = 0, emulate_mute = False):
@@ -258,27 +1028,33 @@ class MixerControlAbstract(MixerChannel):
     def on_any_changed(self, volume, mute):
         pass
     
-    def on_change(self):
-        #@bug: alsa needs reopen mixer if volume changed by side events
-        self.reopen()
-        volume = self.get_volume()
-        mute = self.get_mute()
+    def on_rec_changed(self, rec):
+        pass
+    
+    def on_sample(self, volume, mute, rec = None):
         volume_changed = self.is_volume_changed(volume)
         mute_changed = self.is_mute_changed(mute)
-        if ( volume_changed or mute_changed ):
-            log.Notice("Volume changed: %s:%s, %s->%s, mute=%s->%s" % (self.card_index, self.control, self.last_volume, volume, self.last_mute, mute))
+        rec_changed = ( rec is not None and self.last_rec is not None and bool(self.last_rec) != rec )
+        if ( volume_changed or mute_changed or rec_changed ):
+            log.Notice("Volume changed: %s:%s, %s->%s, mute=%s->%s, rec=%s->%s", self.card_index, self.control, self.last_volume, volume, self.last_mute, mute, self.last_rec, rec)
+            
+            #hooks read status snapshot, so it is updated first
+            self.last_mute = mute
+            self.last_volume = volume
+            if (rec_changed):
+                self.last_rec = rec
+            self.update_status()
 
             #disable feedback events from slider and menu
             if(volume_changed):
                 self.on_volume_changed(volume)
             if(mute_changed):
                 self.on_mute_changed(mute)
+            if(rec_changed):
+                self.on_rec_changed(rec)
             
             self.on_any_changed(volume, mute)
-            
-            self.last_mute = mute
-            self.last_volume = volume
-        return True
+        return volume_changed or mute_changed or rec_changed
 
     def save(self):
         pass
@@ -307,7 +1083,7 @@ class MixerControlLocableAbstract(MixerControlAbstract):
         if ( not self.config.has_section(self.mixer_section) ):
             self.config.add_section(self.mixer_section)
         lock = self.get_lock()
-        log.Notice("control = %s lock = %s" % (self.control, lock))
+        log.Notice("control = %s lock = %s", self.control, lock)
         if ( not self.config.has_option(self.mixer_section, self.key) or lock != self.config.getboolean(self.mixer_section, self.key) ):
             self.config.set(self.mixer_section, self.key, lock)
 
@@ -321,10 +1097,8 @@ class MixerAbstract():
         self.config = config
         self.controls = []
         self.card_index = card_index
+        self.connected = False
         self.init()
-        #get_descriptors + gobject.io_add_watch is bad choice, becouse it's events start repeats infinitely after first event
-        #the best way is snd_mixer_set_callback, but it not implemented in pyalsa
-        #so get alsa status in timer
 
     def __del__(self):
         log.Notice("deleting mixer")
@@ -334,15 +1108,35 @@ class MixerAbstract():
             
     def add_control(self, control):
         self.controls.append( control )
+        if (self.connected):
+            MixerHandler.subscribe(control)
         
     def del_control(self, control):
+        if (self.connected):
+            MixerHandler.unsubscribe(control)
         self.controls.remove(control)
         del control
                 
-    def on_change(self):
+    def connect(self):
+        """ Subscribes controls to card sampler, controls added later are subscribed too """
+        self.connected = True
         for control in self.controls:
-            control.on_change()
-        return True
+            MixerHandler.subscribe(control)
+        
+    def disconnect(self):
+        self.connected = False
+        for control in self.controls:
+            MixerHandler.unsubscribe(control)
+            
+    def refresh(self):
+        """ Updates connected controls from fresh read """
+        MixerHandler.sample(self.card_index)
+            
+    def close(self):
+        """ Releases mixer handles of all controls """
+        self.disconnect()
+        for control in self.controls:
+            control.close()
             
     @abstractmethod
     def init(self):
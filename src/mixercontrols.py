@@ -16,10 +16,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import gtk
+import gobject
 import os
+import time
 from abc import abstractmethod
 from mixerbase import MixerControlLocableAbstract
 from debug import log
+from metrics import Metrics
+from watchdog import MainLoopWatchdog
 
 class VolumeSlider(gtk.VScale):
     def __init__(self, show_value, channel_index, max, default, hook):
@@ -108,6 +112,9 @@ class MixerControl(MixerControlLocableAbstract):
     """
 
     def __init__(self, config, card_index, control, cid):
+        self.slider_pending = {}
+        self.slider_source = None
+        self.slider_written = 0
         MixerControlLocableAbstract.__init__(self, config, card_index, control, cid)
         self.sliders = []
         self.buttons = {}
@@ -119,11 +126,13 @@ class MixerControl(MixerControlLocableAbstract):
         self.sliders = []
         self.buttons = {}
         max = self.get_channel_count()
-        show_value = self.config.getboolean(self.config.get_default_section(), "mixer_show_values")
+        show_value = self.config.get_snapshot().mixer_show_values
         
         volumes = self.get_volume()
         for channel_index, volume in enumerate(volumes):
-            self.sliders.append( VolumeSlider(show_value, channel_index, max, volume, self.on_slider_value_changed) )
+            slider = VolumeSlider(show_value, channel_index, max, volume, self.on_slider_value_changed)
+            slider.connect("button-release-event", self.on_slider_released)
+            self.sliders.append(slider)
         
         self.buttons['mute'] = MuteButton(self.config.res_dir, self.get_mute(), self.on_mute_button)
         
@@ -153,33 +162,75 @@ class MixerControl(MixerControlLocableAbstract):
         
     
     def on_rec_button(self, active):
-        log.Notice("rec button state changed to %s" % active)
+        log.Notice("rec button state changed to %s", active)
         self.set_rec(active)
 
     def on_lock_button(self, active):
         self.set_lock(active)
-        log.Notice("lock button state changed to %s = %s" % (active, self.get_lock()))
+        log.Notice("lock button state changed to %s = %s", active, self.get_lock())
     
     def on_mute_button(self, active):
-        log.Notice("mute button state changed to %s" % active)
+        log.Notice("mute button state changed to %s", active)
         self.set_mute(bool(active))
             
     def on_slider_value_changed(self, slider, data=None):
         volume = int(slider.get_value())
         if(self.get_lock()):
             self._slider_sync_values(slider, volume)
-        self.set_volume(volume, slider.channel_index)
+            self.slider_pending = {None: volume}
+        else:
+            self.slider_pending[slider.channel_index] = volume
+        self._schedule_slider_write()
         
+    def on_slider_released(self, slider, event):
+        self.flush_sliders()
+        return False
         
     def _slider_sync_values(self, slider, volume):
         """if locked, set all other sliders to same value"""
         for current_slider in self.sliders:
             if (current_slider.channel_index != slider.channel_index):
                 current_slider.set_value(volume)
-                self.set_volume(volume, current_slider.channel_index)
+    
+    def _schedule_slider_write(self):
+        """ Writes slider values at most slider_write_rate times per second """
+        if (self.slider_source):
+            return
+        rate = self.config.get_snapshot().slider_write_rate
+        interval = 1000.0 / max(1, rate)
+        elapsed = (time.time() - self.slider_written) * 1000
+        if ( elapsed >= interval ):
+            self.flush_sliders()
+        else:
+            self.slider_source = gobject.timeout_add(int(interval - elapsed), self.flush_sliders)
+            
+    def flush_sliders(self):
+        """ Writes pending slider values, unchanged values are skipped """
+        if (self.slider_source):
+            gobject.source_remove(self.slider_source)
+            self.slider_source = None
+        pending = self.slider_pending
+        self.slider_pending = {}
+        
+        volume = self.get_volume()
+        #all channels value (None) goes first
+        for channel, value in sorted(pending.items()):
+            if ( channel == None ):
+                volume = [value] * self.get_channel_count()
+            else:
+                volume[channel] = value
+        if ( volume != self.get_volume() ):
+            self.set_volume(volume)
+            self.slider_written = time.time()
+            self.on_volume_set()
+        return False
+    
+    def on_volume_set(self):
+        """ Called after slider values are written """
+        pass
                 
     def on_volume_changed(self, volume):
-        log.Notice("volume changed by other side to %s" % volume)
+        log.Notice("volume changed by other side to %s", volume)
         event_from_external_source = True
         if (event_from_external_source):
             for slider in self.sliders:
@@ -187,10 +238,15 @@ class MixerControl(MixerControlLocableAbstract):
             
         
     def on_mute_changed(self, mute):
-        log.Notice("mute state changed by other side to %s" % mute)
+        log.Notice("mute state changed by other side to %s", mute)
         event_from_external_source = True
         if (event_from_external_source):
             self.buttons['mute'].set_active( mute )
+            
+    def on_rec_changed(self, rec):
+        log.Notice("rec state changed by other side to %s", rec)
+        if ( 'rec' in self.buttons ):
+            self.buttons['rec'].set_active( rec )
     
     def on_any_changed(self, volume, mute):
         pass
@@ -211,6 +267,7 @@ class MixerControlFrame(MixerControl):
         self.frame.destroy()
         
     def update(self, card_index, control, cid):
+        self.flush_sliders()
         self.frame.remove( self.align )
         MixerControl.update(self, card_index, control, cid)
         self.align = self._make_control()
@@ -218,6 +275,13 @@ class MixerControlFrame(MixerControl):
         label = self.get_label(control, cid)
         self.frame.set_label(label)
         
+    def on_open(self):
+        """ Rebuilds widgets from placeholder, channel count and rec switch are known after open """
+        self.frame.remove( self.align )
+        self.align = self._make_control()
+        self.frame.add( self.align )
+        self.align.show_all()
+        
     def get_label(self, control, cid):
         if (cid != 0):
             label = "%s %i" % (control, cid)
@@ -228,6 +292,9 @@ class MixerControlFrame(MixerControl):
 
 class ApplicationAbstract:
     def run(self):
+        Metrics.install()
+        #opt-in, logs stack of callback, which blocks main loop longer than threshold in ms
+        MainLoopWatchdog.install(self.config.get_snapshot().watchdog_threshold)
         try:
             gtk.main()
         except KeyboardInterrupt:
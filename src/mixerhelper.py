@@ -32,8 +32,9 @@ class MixerHelper():
     def toggle_mixer(self):
         """ Toggle mixer application """
         mixer = self.get_mixer_name()
-        run = self.config.getboolean(self.config.get_default_section(), "run_in_terminal") and not self.config.getboolean(self.config.get_default_section(), "mixer_internal")
-        log.Notice("Launching mixer %s / %s" % (mixer, run) )
+        config = self.config.get_snapshot()
+        run = config.run_in_terminal and not config.mixer_internal
+        log.Notice("Launching mixer %s / %s", mixer, run)
         if not mixer:
             return
         try:
@@ -48,13 +49,14 @@ class MixerHelper():
                     cmd = utils.which(mixer)
                 Popen(cmd, shell=False)
         except Exception, err:
-            log.Warn("Can\'t find mixer: %s" % str(err) )
+            log.Warn("Can\'t find mixer: %s", str(err))
 
     def get_mixer_name(self):
-        if (self.config.getboolean(self.config.get_default_section(), "mixer_internal")):
+        config = self.config.get_snapshot()
+        if (config.mixer_internal):
             mixer = "voltilite-mixer"
         else:
-            mixer = self.config.get(self.config.get_default_section(), "mixer")
+            mixer = config.mixer
         return mixer 
         
     def _mixer_get_pid(self):
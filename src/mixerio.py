@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+# Author: Milan Nikolic <gen2brain@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import gobject
+from threading import Thread, Condition
+from debug import log
+
+#idle_add from worker thread must wake up main loop
+gobject.threads_init()
+
+class MixerWorker(Thread):
+    """ Thread that owns mixer handles, writes are coalesced and run before other jobs """
+    def __init__(self):
+        Thread.__init__(self, name = "mixer-io")
+        self.setDaemon(True)
+        self.lock = Condition()
+        self.writes = {}
+        self.order = []
+        self.jobs = []
+
+    def write(self, key, func, *args):
+        self.lock.acquire()
+        if ( key in self.writes ):
+            self.order.remove(key)
+        self.writes[key] = (func, args)
+        self.order.append(key)
+        self.lock.notify()
+        self.lock.release()
+
+    def post(self, func, args = (), callback = None):
+        self.lock.acquire()
+        self.jobs.append( (func, args, callback) )
+        self.lock.notify()
+        self.lock.release()
+
+    def run(self):
+        while True:
+            self.lock.acquire()
+            while ( not self.order and not self.jobs ):
+                self.lock.wait()
+            if (self.order):
+                (func, args) = self.writes.pop(self.order.pop(0))
+                callback = None
+            else:
+                (func, args, callback) = self.jobs.pop(0)
+            self.lock.release()
+
+            try:
+                result = func(*args)
+            except Exception, err:
+                log.Warn("Mixer call failed: %s", str(err))
+                continue
+            if (callback):
+                gobject.idle_add(self.on_result, callback, result)
+
+    def on_result(self, callback, result):
+        callback(result)
+        return False
+
+class MixerIO:
+    """ Runs mixer calls in mixer thread, so slow drivers don't block main loop """
+    worker = None
+
+    @staticmethod
+    def get_worker():
+        if ( not MixerIO.worker ):
+            MixerIO.worker = MixerWorker()
+            MixerIO.worker.start()
+        return MixerIO.worker
+
+    @staticmethod
+    def write(key, func, *args):
+        """ Queues write, pending write with the same key is replaced by the latest one """
+        MixerIO.get_worker().write(key, func, *args)
+
+    @staticmethod
+    def read(func, callback, *args):
+        """ Queues read, callback gets result in main loop, func must catch its errors """
+        MixerIO.get_worker().post(func, args, callback)
+
+    @staticmethod
+    def post(func, *args):
+        """ Queues call, result is dropped """
+        MixerIO.get_worker().post(func, args)
@@ -15,73 +15,189 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+import time
 import dbus
+import gobject
 from debug import log
 from icons import Icons
+from voltisession import VoltiSession
+from metrics import Metrics
+
+class NotificationServer:
+    """ Notification daemon proxy, capabilities are cached until daemon changes owner """
+    name = 'org.freedesktop.Notifications'
+    interface = None
+    capable = False
+    
+    @staticmethod
+    def get_interface():
+        if ( not NotificationServer.interface ):
+            bus = VoltiSession.get_bus()
+            #no blocking name activation and introspection, proxy is resolved when first call is sent
+            obj = bus.get_object(NotificationServer.name, '/org/freedesktop/Notifications',
+                                 introspect = False, follow_name_owner_changes = True)
+            NotificationServer.interface = dbus.Interface(obj, NotificationServer.name)
+            bus.add_signal_receiver(NotificationServer.on_owner_changed, "NameOwnerChanged",
+                                    "org.freedesktop.DBus", "org.freedesktop.DBus", "/org/freedesktop/DBus",
+                                    arg0 = NotificationServer.name)
+            NotificationServer.check_capabilities()
+        return NotificationServer.interface
+    
+    @staticmethod
+    def check_capabilities():
+        NotificationServer.interface.GetServerInformation(reply_handler = NotificationServer.on_server_information,
+                                                          error_handler = NotificationServer.on_error)
+    
+    @staticmethod
+    def on_server_information(name, vendor, version, spec_version = ""):
+        log.Notice("notify %s", str(name))
+        NotificationServer.capable = bool(name != "notify-osd")
+        
+    @staticmethod
+    def on_owner_changed(name, old_owner, new_owner):
+        log.Notice("notification daemon changed: '%s' -> '%s'", old_owner, new_owner)
+        NotificationServer.capable = False
+        if (new_owner):
+            NotificationServer.check_capabilities()
+    
+    @staticmethod
+    def on_error(err):
+        """ Daemon is not running or not responding, notifications are skipped until it is back """
+        log.Warn("Notification daemon error: %s", str(err))
 
 class Notification:
     """ Desktop notifications """
+    #notification is repainted at most once per this interval, in ms
+    min_interval = 100
+    placeholder = re.compile(r"\{(volume|card|mixer|channels|rec)\}")
 
     def __init__(self, config, get_geometry_hook):
         """ Constructor """
         self.config = config
         self.last_id = None
         self.info = False
+        #only one Notify call is in flight, so last_id is known before the next one
+        self.sending = False
+        self.pending = False
+        self.source = None
+        self.last_sent = 0
         self.get_geometry_hook = get_geometry_hook
+        self.body = None
+        self.on_config_changed(config.get_snapshot())
+        self.config.subscribe(self.on_config_changed)
         self.open()
         
     def open(self):
-        bus = dbus.SessionBus()
-        obj = bus.get_object('org.freedesktop.Notifications', '/org/freedesktop/Notifications')
-        self.notify = dbus.Interface(obj, 'org.freedesktop.Notifications')
-        self.server_capable = self.check_capabilities()
-        if (self.server_capable):
-            self.title = _("Mixer")
-        else:
-            self.title = ""
+        self.notify = NotificationServer.get_interface()
         self.last_id = dbus.UInt32()
 
     def close(self):
         """ Close the notification """
+        if (self.source):
+            gobject.source_remove(self.source)
+            self.source = None
+        self.pending = False
+        self.config.unsubscribe(self.on_config_changed)
         if self.last_id:
-            self.notify.CloseNotification(self.last_id)
+            self.notify.CloseNotification(self.last_id,
+                                          signature = "u",
+                                          reply_handler = self.on_closed,
+                                          error_handler = NotificationServer.on_error)
             self.last_id = None
             
-    def reopen(self):
-        self.close()
-        self.open()
+    def on_closed(self):
+        pass
+            
+    def on_config_changed(self, config):
+        if ( config.notify_body != self.body ):
+            self.body = config.notify_body
+            self.compile(self.body)
+            
+    def compile(self, body):
+        """ Turns notify_body into format string, so body is rendered in one pass """
+        body = body.replace("%", "%%")
+        self.template = self.placeholder.sub(r"%(\1)s", body)
             
     def update(self, info):
         """ Update notification """
         self.info = info
     
     def __del__(self):
-        log.Notice("destroy", 1)
+        log.Notice("destroy", depth = 1)
         self.close()
 
-    def check_capabilities(self):
-        info = self.notify.GetServerInformation()
-        log.Notice("notify %s" % str(info[0]))
-        return bool(info[0] != "notify-osd")
-
     def show(self):
         """ Show the notification """
         if (not self.info):
             return
+        self.pending = True
+        self.schedule()
         
-        duration = self.config.getfloat(self.config.get_default_section(), "notify_timeout")
+    def schedule(self):
+        """ Sends latest state now or when interval since last one is over """
+        if (self.sending or self.source):
+            return
+        delay = int(self.last_sent + self.min_interval - time.time() * 1000)
+        if (delay > 0):
+            self.source = gobject.timeout_add(delay, self.on_timeout)
+        else:
+            self.send()
+            
+    def on_timeout(self):
+        self.source = None
+        self.schedule()
+        return False
         
-        [volume, muted, var, card_name, mixer_name] = self.info
-        volume = volume[0]
+    def send(self):
+        self.pending = False
+        self.sent_at = time.time()
+        self.last_sent = self.sent_at * 1000
+        config = self.config.get_snapshot()
+        
+        info = self.info
+        volume = info.volume[0]
         icon = Icons.get_icon_name_by_volume(volume)
         
-        body = self.format(volume, muted, var, card_name, mixer_name)
+        body = self.format(info)
         hints = {"urgency": dbus.Byte(0), "desktop-entry": dbus.String("volti")}
         
-        if self.config.getboolean(self.config.get_default_section(), "notify_position") and self.server_capable:
+        capable = NotificationServer.capable
+        if (capable):
+            title = _("Mixer")
+        else:
+            title = ""
+        
+        if config.notify_position and capable:
             hints["x"], hints["y"] = self.get_position()
             
-        self.last_id = self.notify.Notify('volume', self.last_id, icon, self.title, body, [], hints, duration * 1000)
+        self.sending = True
+        Metrics.count("dbus.notify")
+        #proxy is not introspected, so signature can't be guessed from arguments
+        try:
+            self.notify.Notify('volume', self.last_id or dbus.UInt32(), icon, title, body, [], hints,
+                               int(config.notify_timeout * 1000),
+                               signature = "susssasa{sv}i",
+                               reply_handler = self.on_shown,
+                               error_handler = self.on_show_error)
+        except Exception, err:
+            self.on_show_error(err)
+
+    def on_shown(self, notify_id):
+        Metrics.observe("dbus.notify", self.sent_at)
+        self.last_id = notify_id
+        self.on_sent()
+
+    def on_show_error(self, err):
+        NotificationServer.on_error(err)
+        #replaced notification can be gone with restarted daemon
+        self.last_id = dbus.UInt32()
+        self.on_sent()
+
+    def on_sent(self):
+        self.sending = False
+        if (self.pending):
+            self.schedule()
 
     def get_position(self):
         """ Returns status icon center coordinates """
@@ -90,11 +206,16 @@ class Notification:
         posy = rectangle.y + rectangle.height/2
         return posx, posy
 
-    def format(self, volume, muted, var, card_name, mixer_name):
+    def format(self, info):
         """ Format notification body """
-        message = self.config.get(self.config.get_default_section(), "notify_body")
-        volume = Icons.get_volume_name(volume, muted)
-        message = message.replace('{volume}', '%s%s' % (volume, var))
-        message = message.replace('{card}', '%s: %s' % (_("Card"), card_name))
-        message = message.replace('{mixer}', '%s: %s' % (_("Mixer"), mixer_name))
-        return message
+        if (info.rec):
+            rec = _("Capture")
+        else:
+            rec = ""
+        return self.template % {
+            "volume": "%s%s" % (Icons.get_volume_name(info.volume[0], info.muted), info.var),
+            "card": "%s: %s" % (_("Card"), info.card_name),
+            "mixer": "%s: %s" % (_("Mixer"), info.mixer_name),
+            "channels": " / ".join(["%s%s" % (level, info.var) for level in info.volume]),
+            "rec": rec
+            }
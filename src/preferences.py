@@ -175,7 +175,12 @@ class Preferences:
         
         card_combobox = self.tree.get_object("card_combobox")
         card_combobox.set_model(self.combo_model)
-        card_combobox.set_active(self.config.getint(default, "card_index"))
+        #rows are not card indexes, cards list has gaps for unused card numbers
+        card_index = self.config.getint(default, "card_index")
+        for row in self.combo_model:
+            if ( row[0] == card_index ):
+                card_combobox.set_active_iter(row.iter)
+                break
 
         cell1 = gtk.CellRendererPixbuf()
         cell1.set_property("xalign", 0)
@@ -279,7 +284,7 @@ class Preferences:
         default_cid = self.config.getint(self.config.get_card_section(), "cid")
         mixers = CardInfo.get_mixers(card_index)
         liststore.clear()
-        log.Notice("default_mixer = %s, default_cid = %i" % (default_mixer, default_cid))
+        log.Notice("default_mixer = %s, default_cid = %i", default_mixer, default_cid)
         for mixer, cid in mixers:
             active = (card_index == card_index_cmp and mixer == default_mixer and cid == default_cid )
             weight = pango.WEIGHT_NORMAL
@@ -18,35 +18,55 @@
 import sys
 import gettext
 import gtk
+import gobject
 import os
 from config import Config
 from debug import log
 from icons import Icons
 from mixercontrols import MixerControlFrame, ApplicationAbstract
-from mixerbase import MixerHandler
+from mixerbase import MixerHandler, CardMonitor
 from mixerhelper import MixerHelper
 from preferences import Preferences
 from notification import Notification
+from config import ConfigMonitor
+from metrics import Metrics
+from changebus import ChangeBus
 
 class TrayMixerControlFrame(MixerControlFrame):
-    def __init__(self, config, on_volume_changed_hook, on_mute_changed_hook):
-        self.mixer_handle = False
+    #scroll steps within this window are written and shown as one change
+    scroll_delay = 40
+    
+    def __init__(self, config, bus):
         self.config = config
-        
-        self.on_volume_changed_hook = on_volume_changed_hook
-        self.on_mute_changed_hook = on_mute_changed_hook
+        self.bus = bus
+        self.scroll_source = None
+        self.scroll_volume = 0
         
         [card_index, control_name, cid] = self.get_config_params()
         MixerControlFrame.__init__(self, config, card_index, control_name, cid)
-        self.mixer_handle = MixerHandler.connect(self.on_change)
+        MixerHandler.subscribe(self)
         self.frame.set_shadow_type(gtk.SHADOW_OUT)
+        self.publish()
 
     def update(self):
         [card_index, control_name, cid] = self.get_config_params()
-        MixerHandler.disconnect(self.mixer_handle)
+        self.flush_scroll()
+        MixerHandler.unsubscribe(self)
         MixerControlFrame.update(self, card_index, control_name, cid)
         self.frame.set_shadow_type(gtk.SHADOW_OUT)
-        self.mixer_handle = MixerHandler.connect(self.on_change)
+        MixerHandler.subscribe(self)
+        self.publish()
+        
+    def on_open(self):
+        MixerControlFrame.on_open(self)
+        self.publish()
+        
+    def publish(self, external = False, **changes):
+        """ Publishes status snapshot and changed fields, external changes are shown in notification """
+        changes["status"] = self.get_status_info()
+        if (external):
+            changes["external"] = True
+        self.bus.publish(**changes)
         
     def get_config_params(self):
         card_index = self.config.getint(self.config.get_default_section(), "card_index")
@@ -55,24 +75,28 @@ class TrayMixerControlFrame(MixerControlFrame):
         return [card_index, control_name, cid]
         
     def __del__(self):
-        MixerHandler.disconnect(self.mixer_handle)
+        self.flush_scroll()
+        MixerHandler.unsubscribe(self)
         MixerControlFrame.__del__(self)
         
     def on_volume_changed(self, volume):
         MixerControlFrame.on_volume_changed(self, volume)
-        self.on_volume_changed_hook(True)
+        self.publish(True, volume = volume)
         
     def on_mute_button(self, active):
         MixerControlFrame.on_mute_button(self, active)
-        self.on_mute_changed_hook(False)
+        self.publish(mute = self.get_mute())
         
     def on_mute_changed(self, mute):
         MixerControlFrame.on_mute_changed(self, mute)
-        self.on_mute_changed_hook(True)
+        self.publish(True, mute = mute)
+        
+    def on_rec_changed(self, rec):
+        MixerControlFrame.on_rec_changed(self, rec)
+        self.publish(rec = rec)
         
-    def on_slider_value_changed(self, slider, data=None):
-        MixerControlFrame.on_slider_value_changed(self, slider, data)
-        self.on_volume_changed_hook(False)
+    def on_volume_set(self):
+        self.publish(volume = self.get_volume())
     
     def toggle_mute(self):
         self.on_mute_button(not self.get_mute())
@@ -84,34 +108,52 @@ class TrayMixerControlFrame(MixerControlFrame):
         self._step_change_volume(True)
         
     def _step_change_volume(self, step_down):
-        inc = self.config.getfloat(self.config.get_default_section(), "scale_increment")
-        volume = self.get_volume()
-        volume = float(volume[0])
+        inc = self.config.get_snapshot().scale_increment
+        if (self.scroll_source):
+            volume = float(self.scroll_volume)
+        else:
+            volume = float(self.get_volume()[0])
         if (step_down):
             volume = max(0, volume - inc)
         else:
             volume = min(100, volume + inc)
-        volume = int(volume)
-        volume = [volume] * self.get_channel_count()
-        self.set_volume(volume[0])
+        self.scroll_volume = int(volume)
         
-        MixerControlFrame.on_volume_changed(self, volume)
-        self.on_volume_changed_hook(False)
+        #sliders follow every step, hardware and tray are updated once per burst
+        for slider in self.sliders:
+            slider.set_value(self.scroll_volume)
+        if ( not self.scroll_source ):
+            self.scroll_source = gobject.timeout_add(self.scroll_delay, self.on_scroll_timeout)
+            
+    def on_scroll_timeout(self):
+        self.scroll_source = None
+        volume = [self.scroll_volume] * self.get_channel_count()
+        self.set_volume(volume)
         
-        #self.on_volume_changed(volume)
+        MixerControlFrame.on_volume_changed(self, volume)
+        self.publish(volume = volume)
+        return False
+    
+    def flush_scroll(self):
+        """ Applies pending scroll steps now """
+        if (self.scroll_source):
+            gobject.source_remove(self.scroll_source)
+            self.on_scroll_timeout()
         
 
 class TrayMixerWindow(gtk.Window): 
-    def __init__(self, config, on_volume_changed_hook, on_mute_changed_hook, get_geometry_hook):
+    def __init__(self, config, bus, get_geometry_hook):
         gtk.Window.__init__(self, type=gtk.WINDOW_POPUP)
         
         self.get_geometry_hook = get_geometry_hook
         
-        self.mixer = TrayMixerControlFrame(config, on_volume_changed_hook, on_mute_changed_hook)
+        self.mixer = TrayMixerControlFrame(config, bus)
         
         self.resize(1, 1)
         self.add(self.mixer.frame)
         self.connect_after("realize", self.on_realize)
+        self.connect("map", self.on_map)
+        self.connect("unmap", self.on_unmap)
         self.connect("key_release_event", self.on_window_key_release_event)
         self.connect("button_press_event", self.on_window_button_press_event)
 
@@ -129,6 +171,13 @@ class TrayMixerWindow(gtk.Window):
         """ Callback for realize. Move window when realized """
         self.move_window()
         
+    def on_map(self, widget):
+        """ Poll fast while slider is shown """
+        MixerHandler.hold(True)
+        
+    def on_unmap(self, widget):
+        MixerHandler.hold(False)
+        
     def move_window(self):
         """ Move scale window """
         posx, posy = self.get_position()
@@ -214,28 +263,27 @@ class TrayIcon(gtk.StatusIcon):
 
     def update(self, info):
         """ Update icon """
-        [volume, muted, var, card_name, mixer_name] = info
-        vol = volume[0]
-        if (muted):
+        vol = info.volume[0]
+        if (info.muted):
             vol = 0
         icon = Icons.get_icon_name_by_volume(vol)
         self.set_from_icon_name(icon)
         
         #""" Update tooltip """
         tooltip = "<b>%s: %s%s </b>\n<small>%s: %s\n%s: %s</small>" % (
-                _("Output"), Icons.get_volume_name(vol, muted),
-                var, _("Card"), card_name,
-                _("Mixer"), mixer_name)
+                _("Output"), Icons.get_volume_name(vol, info.muted),
+                info.var, _("Card"), info.card_name,
+                _("Mixer"), info.mixer_name)
         self.set_tooltip_markup(tooltip)
             
 class TrayPopupMenu(gtk.Menu):
     """ Popup menu """
-    def __init__(self, config, on_mute_button_hook, get_mute_hook, on_quit_hook, on_show_preferences_hook, parent):
+    def __init__(self, config, bus, on_mute_button_hook, on_quit_hook, on_show_preferences_hook, parent):
         self.config = config
         gtk.Menu.__init__(self)
         self.parent_widget = parent
         self.on_mute_button_hook = on_mute_button_hook
-        self.get_mute_hook = get_mute_hook
+        self.bus = bus
 
         self.item_mute = gtk.CheckMenuItem(_("Mute"))
         self.mute_handler_id = self.item_mute.connect("toggled", self.on_toggle_mute)
@@ -258,7 +306,7 @@ class TrayPopupMenu(gtk.Menu):
         
     def update_items(self):
         self.item_mute.handler_block(self.mute_handler_id)
-        self.item_mute.set_active(self.get_mute_hook())
+        self.item_mute.set_active(self.bus.get("status").muted)
         self.item_mute.handler_unblock(self.mute_handler_id)
         
     def on_popup_event(self, status, button, time):
@@ -280,6 +328,7 @@ class TrayApplication(ApplicationAbstract):
         self.config = Config()
         self.preferences = False
         self.control = False
+        MixerHandler.configure(self.config)
     
         gettext.bindtextdomain(self.config.app_name, self.config.locale_dir)
         gettext.textdomain(self.config.app_name)
@@ -288,14 +337,17 @@ class TrayApplication(ApplicationAbstract):
         
         self.tray = TrayIcon(self.config)
         
+        self.bus = ChangeBus()
+        self.bus.subscribe(("status",), self.on_status_changed)
+        self.bus.subscribe(("external",), self.on_external_changed)
+        
         self.control = TrayMixerWindow(self.config,
-                                       self.on_volume_changed,
-                                       self.on_mute_changed,
+                                       self.bus,
                                        self.tray.get_geometry)
         
         self.menu = TrayPopupMenu(self.config,
+                                  self.bus,
                                   self.control.mixer.on_mute_button,
-                                  self.control.mixer.get_mute,
                                   self.quit,
                                   self.on_show_preferences,
                                   self.tray
@@ -309,14 +361,15 @@ class TrayApplication(ApplicationAbstract):
         self.update_notify()
         self.update()
         
+        self.monitor = CardMonitor(self.on_cards_changed)
+        self.config_monitor = ConfigMonitor(self.config, self.on_config_reloaded)
+        
     def update_notify(self):
-        show = self.config.getboolean(self.config.get_default_section(), "show_notify")
+        show = self.config.get_snapshot().show_notify
         if (self.notify):
-            if (show):
-                del self.notify
+            if (not show):
+                self.notify.close()
                 self.notify = False
-            else:
-                self.notify.reopen()
         else:
             if (show):
                 self.notify = Notification(self.config, self.tray.get_geometry)
@@ -327,35 +380,38 @@ class TrayApplication(ApplicationAbstract):
     def update(self):
         info = self.control.mixer.get_status_info()
         self.tray.update(info)
+        #change detected in mixer is painted
+        if ( self.control.mixer.changed_at ):
+            Metrics.observe("change.paint", self.control.mixer.changed_at)
+            self.control.mixer.changed_at = None
         if (self.notify):
             self.notify.update(info)
     
     def show(self):
-        log.Notice("update_show", 1)
+        log.Notice("update_show", depth = 1)
         if (self.notify):
             self.notify.show()
     
-    def on_volume_changed(self, show):
+    def on_status_changed(self, changes):
         self.update()
-        if (show):
-            self.show()
-
-    def on_mute_changed(self, show):
-        self.on_volume_changed(show)
+        
+    def on_external_changed(self, changes):
+        """ Changes made by other applications are shown in notification """
+        self.show()
         
     def on_tray_press_event(self, widget, event, data=None):
         if event.button == 1:
             self.control.toggle()
         elif event.button == 2:
-            toggle = self.config.get(self.config.get_default_section(), "toggle")
+            toggle = self.config.get_snapshot().toggle
             if (toggle == "mute"):
                 self.control.mixer.toggle_mute()
-                self.update()
             elif (toggle == "mixer"):
                 self.menu.on_show_mixer()
                 
     def on_window_scroll_event(self, widget, event):
         log.Notice("scroll event")
+        MixerHandler.kick()
         if event.direction == gtk.gdk.SCROLL_UP:
             self.control.mixer.inc_volume()
         elif event.direction == gtk.gdk.SCROLL_DOWN:
@@ -367,10 +423,34 @@ class TrayApplication(ApplicationAbstract):
         
     def on_preferences_update(self):
         log.Notice("preferences update")
+        MixerHandler.configure(self.config)
         self.control.update()
         self.update_notify()
         self.update()
         
+    def on_cards_changed(self, cards):
+        """ Rebinds tray control to its card after hotplug """
+        #frame is rebuilt only if tray control moved, handles of changed cards are reopened on next read
+        if ( self.config.rebind_card() ):
+            self.control.update()
+            self.update()
+        
+    def on_config_reloaded(self, changed):
+        """ Reapplies only subsystems affected by external config edit, scroll step and notify body are read from snapshot """
+        default = self.config.get_default_section()
+        options = set([option for (section, option) in changed if section == default])
+        sections = set([section for (section, option) in changed])
+        
+        if ( options & set(["poll_interval", "poll_interval_idle", "poll_backoff_ticks"]) ):
+            MixerHandler.configure(self.config)
+        if ( "show_notify" in options ):
+            self.update_notify()
+        card_changed = self.config.sync_card_binding(options)
+        if ( card_changed or self.config.get_card_section() in sections ):
+            self.config.check_card_index(self.config.get_snapshot().card_index)
+            self.control.update()
+            self.update()
+        
     def on_preferences_close(self):
         self.config.save()
         
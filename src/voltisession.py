@@ -20,10 +20,20 @@ from dbus.mainloop.glib import DBusGMainLoop
 from debug import log
 
 class VoltiSession:
+    session_bus = None
+    
     def __init__(self, app_name):
         log.Notice("running init")
         self.app_name = app_name
-        self.bus = SessionBus(mainloop = DBusGMainLoop() )
+        self.bus = VoltiSession.get_bus()
+        
+    @staticmethod
+    def get_bus():
+        """ One session bus connection for whole process, attached to glib main loop """
+        if ( not VoltiSession.session_bus ):
+            DBusGMainLoop(set_as_default = True)
+            VoltiSession.session_bus = SessionBus()
+        return VoltiSession.session_bus
 
     def check(self):
         log.Notice("running check")
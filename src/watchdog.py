@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# Author: Milan Nikolic <gen2brain@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import thread
+import traceback
+import gobject
+from threading import Thread
+from debug import log
+from metrics import Metrics
+
+class MainLoopWatchdog(Thread):
+    """ Logs main thread stack, when main loop doesn't run its heartbeat within threshold """
+    def __init__(self, threshold):
+        Thread.__init__(self, name = "watchdog")
+        self.setDaemon(True)
+        self.threshold = threshold / 1000.0
+        self.main_ident = thread.get_ident()
+        self.last_beat = time.time()
+        self.stalled = False
+        gobject.timeout_add(max(threshold / 4, 10), self.on_beat)
+
+    @staticmethod
+    def install(threshold):
+        """ Starts watchdog, threshold is in ms, 0 disables it """
+        if ( threshold <= 0 ):
+            return None
+        watchdog = MainLoopWatchdog(threshold)
+        watchdog.start()
+        return watchdog
+
+    def on_beat(self):
+        now = time.time()
+        if (self.stalled):
+            self.stalled = False
+            log.Warn("Main loop resumed after %dms", (now - self.last_beat) * 1000)
+        self.last_beat = now
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.threshold / 2)
+            stall = time.time() - self.last_beat
+            if ( stall > self.threshold and not self.stalled ):
+                self.stalled = True
+                Metrics.count("mainloop.stalls")
+                self.report(stall)
+
+    def report(self, stall):
+        frame = sys._current_frames().get(self.main_ident)
+        if ( not frame ):
+            return
+        stack = traceback.extract_stack(frame)
+        log.Warn("Main loop stalled for %dms in %s\n%s", stall * 1000,
+                 self.get_callback(stack), "".join(traceback.format_list(stack)).rstrip())
+
+    def get_callback(self, stack):
+        """ Returns outermost frame called by main loop, i.e. callback which doesn't return """
+        for index, (filename, lineno, name, text) in enumerate(stack):
+            #ApplicationAbstract.run, which runs gtk.main
+            if ( name == "run" and os.path.basename(filename).startswith("mixercontrols.") and index + 1 < len(stack) ):
+                (filename, lineno, name, text) = stack[index + 1]
+                return "%s:%s:%s" % (os.path.basename(filename), name, lineno)
+        return "unknown callback"